@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtCore import QSize
+
+from service.util import DECODERS, read_image
+
+
+def time_decode(file_path, decoder, size, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        read_image(file_path, size, decoder=decoder)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure every registered decoder on the images of a directory')
+    parser.add_argument("dir", help="image dir")
+    parser.add_argument("-n", "--runs", help="number of runs per image", type=int, default=3)
+    parser.add_argument("--size", help="scaled decode size", type=int, default=160)
+    args = parser.parse_args()
+
+    files = sorted(os.path.join(args.dir, f) for f in os.listdir(args.dir))
+    size = QSize(args.size, args.size)
+    for decoder in DECODERS:
+        caps = [cap for cap in ('scaled', 'roi', 'preview', 'thread_safe') if getattr(decoder, cap)]
+        print(f'{decoder.name} ({", ".join(caps)})')
+        for file_path in files:
+            if not decoder.supports(os.path.splitext(file_path)[1].lower()):
+                continue
+            try:
+                full = time_decode(file_path, decoder, None, args.runs)
+                scaled = time_decode(file_path, decoder, size, args.runs)
+            except Exception as e:
+                print(f'  {os.path.basename(file_path)}: failed, {e}')
+                continue
+            print(f'  {os.path.basename(file_path)}: full {full * 1000:.1f}ms, scaled {scaled * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
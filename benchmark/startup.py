@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_once(target):
+    env = dict(os.environ, PICV_STARTUP_BENCH='1')
+    start = time.time()
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'main.py'), target],
+                            cwd=ROOT, env=env, capture_output=True, text=True, timeout=120)
+    marks = {}
+    for line in result.stdout.splitlines():
+        if line.startswith('bench '):
+            _, name, stamp = line.split()
+            marks[name] = float(stamp) - start
+    return marks.get('window'), marks.get('image')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure time-to-window and time-to-first-image of "python main.py <dir>"')
+    parser.add_argument("dir", help="image file or image dir")
+    parser.add_argument("-n", "--runs", help="number of runs", type=int, default=5)
+    args = parser.parse_args()
+
+    windows, images = [], []
+    for i in range(args.runs):
+        window, image = run_once(args.dir)
+        print(f'run {i + 1}: window {window * 1000 if window else float("nan"):.0f}ms, '
+              f'first image {image * 1000 if image else float("nan"):.0f}ms')
+        if window is not None: windows.append(window)
+        if image is not None: images.append(image)
+
+    if windows:
+        print(f'time to window: median {statistics.median(windows) * 1000:.0f}ms')
+    if images:
+        print(f'time to first image: median {statistics.median(images) * 1000:.0f}ms')
+
+
+if __name__ == '__main__':
+    main()
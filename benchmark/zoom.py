@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtGui import QPixmap
+from PyQt5.QtWidgets import QApplication, QGraphicsView
+
+from controller.image_viewer import ImageViewer
+from service.util import read_image
+
+
+def run_sequence(app, viewer: ImageViewer, steps, interactive):
+    """ 放大、平移、缩小，记录每一帧的重绘时间
+
+    interactive 为 False 时关闭预缩放缓存，直接平滑绘制原图，即改动前的行为
+    """
+    viewer.setScaledPixmapCacheEnabled(interactive)
+    viewer.resetAndFit()
+    app.processEvents()
+    frames = []
+
+    def frame(action):
+        start = time.perf_counter()
+        if interactive:
+            viewer.beginInteractiveZoom()
+        action()
+        viewer.viewport().repaint()
+        frames.append(time.perf_counter() - start)
+
+    for _ in range(steps):
+        frame(lambda: viewer.zoomIn(1.1, QGraphicsView.AnchorViewCenter))
+    for _ in range(steps):
+        frame(lambda: viewer.horizontalScrollBar().setValue(viewer.horizontalScrollBar().value() + 40))
+    for _ in range(steps):
+        frame(lambda: viewer.zoomOut(1 / 1.1, QGraphicsView.AnchorViewCenter))
+
+    # 手势结束后的平滑重绘
+    start = time.perf_counter()
+    viewer.endInteractiveZoom()
+    viewer.viewport().repaint()
+    settle = time.perf_counter() - start
+    return frames, settle
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure frame time of a scripted zoom and pan sequence')
+    parser.add_argument("image", help="image file")
+    parser.add_argument("--steps", help="number of frames per phase", type=int, default=20)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=800)
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    viewer = ImageViewer()
+    viewer.resize(args.width, args.height)
+    viewer.show()
+    viewer.setImage(QPixmap.fromImage(read_image(args.image)))
+    app.processEvents()
+
+    for name, interactive in (('smooth', False), ('interactive', True)):
+        frames, settle = run_sequence(app, viewer, args.steps, interactive)
+        frames.sort()
+        print(f'{name}: median {statistics.median(frames) * 1000:.1f}ms, '
+              f'p95 {frames[int(len(frames) * 0.95) - 1] * 1000:.1f}ms, '
+              f'max {frames[-1] * 1000:.1f}ms, settle {settle * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+from PyQt5.QtCore import Qt, QPointF
+from PyQt5.QtGui import QColor, QPainter, QPixmap, QPolygonF
+from PyQt5.QtWidgets import QLabel
+
+from typing import Dict, Any
+
+class HistogramView(QLabel):
+    """ 状态栏中的直方图 """
+
+    COLORS = [QColor(255, 60, 60, 110), QColor(60, 255, 60, 110), QColor(60, 120, 255, 110), QColor(220, 220, 220, 160)]
+
+    def __init__(self, parent=None):
+        super().__init__(parent=parent)
+        self.histWidth = 128
+        self.histHeight = 24
+        self.setFixedSize(self.histWidth, self.histHeight)
+
+    def setStats(self, stats: Dict[str, Any]):
+        """ 绘制 RGB 和亮度直方图，stats 为空时清空 """
+        if stats is None:
+            self.clear()
+            self.setToolTip('')
+            return
+        hist = stats['hist']
+        peak = max(int(hist[:, 1:-1].max()), 1)  # 两端溢出的柱子会压低其余部分，不参与归一化
+
+        pixmap = QPixmap(self.histWidth, self.histHeight)
+        pixmap.fill(QColor(30, 30, 30))
+        painter = QPainter(pixmap)
+        painter.setPen(Qt.NoPen)
+        for channel, color in enumerate(self.COLORS):
+            points = [QPointF(0, self.histHeight)]
+            for i in range(256):
+                value = min(hist[channel][i] / peak, 1.0)
+                points.append(QPointF(i * self.histWidth / 256, self.histHeight * (1 - value)))
+            points.append(QPointF(self.histWidth, self.histHeight))
+            painter.setBrush(color)
+            painter.drawPolygon(QPolygonF(points))
+        painter.end()
+
+        self.setPixmap(pixmap)
+        self.setToolTip(f"高光溢出 {stats['highlight'] * 100:.1f}%，暗部溢出 {stats['shadow'] * 100:.1f}%")
@@ -1,7 +1,6 @@
 import os
 from pathlib import Path
 
-from PyQt5 import uic
 from PyQt5.QtCore import QSize, Qt
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import (
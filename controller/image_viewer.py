@@ -3,14 +3,17 @@ import math
 from PyQt5.QtWidgets import (
     QGraphicsView, QGraphicsScene, QGraphicsPixmapItem, QGraphicsItem
 )
-from PyQt5.QtCore import Qt, QRectF, QSize, QEvent
-from PyQt5.QtGui import QPixmap, QPainter, QWheelEvent
+from PyQt5.QtCore import Qt, QRectF, QSize, QEvent, QTimer, pyqtSignal
+from PyQt5.QtGui import QPixmap, QImage, QPainter, QWheelEvent, QTransform
 
 from typing import Union
 
 class ImageViewer(QGraphicsView):
     """ 图片查看器 """
 
+    # 放大到超过当前图片的分辨率
+    zoomedPastPixmap = pyqtSignal()
+
     def __init__(self, parent=None):
         super().__init__(parent=parent)
         self.zoomInFactors = 1.0
@@ -25,6 +28,25 @@ class ImageViewer(QGraphicsView):
         self.pixmapItem = QGraphicsPixmapItem(self.pixmap)
         self.displayedImageSize = QSize(0, 0)
 
+        # 高光/暗部溢出蒙版，覆盖在图片上
+        self.showClipping = False
+        self.clippingItem = QGraphicsPixmapItem()
+        self.clippingItem.setZValue(1)
+        self.clippingItem.setVisible(False)
+
+        # 缩放手势进行中使用快速变换，停止后平滑重绘
+        self.interactiveZooming = False
+        self.settleTimer = QTimer(self)
+        self.settleTimer.setSingleShot(True)
+        self.settleTimer.setInterval(150)
+        self.settleTimer.timeout.connect(self.endInteractiveZoom)
+
+        # 缩小显示时预先平滑缩放到当前比例的图片，按比例缓存
+        self.maxScaledPixmaps = 4
+        self.useScaledPixmapCache = True
+        self.scaledPixmapCache: dict[int, QPixmap] = {}
+        self.scaledPixmapKey = None
+
         # 初始化小部件
         self.__initWidget()
 
@@ -38,13 +60,17 @@ class ImageViewer(QGraphicsView):
         # 以鼠标所在位置为锚点进行缩放
         self.setTransformationAnchor(self.AnchorUnderMouse)
 
-        # 平滑缩放
+        # 平滑缩放，只有图片不需要抗锯齿
         self.pixmapItem.setTransformationMode(Qt.SmoothTransformation)
-        self.setRenderHints(QPainter.Antialiasing |
-                            QPainter.SmoothPixmapTransform)
+        self.setRenderHints(QPainter.SmoothPixmapTransform)
+
+        # 只有少量图片项，不需要保存画笔状态和为抗锯齿扩大重绘区域
+        self.setViewportUpdateMode(self.SmartViewportUpdate)
+        self.setOptimizationFlags(self.DontSavePainterState | self.DontAdjustForAntialiasing)
 
         # 设置场景
         self.graphicsScene.addItem(self.pixmapItem) # 一个场景能有多个item
+        self.graphicsScene.addItem(self.clippingItem)
         self.setScene(self.graphicsScene) # 设置舞台
 
         # 启用捏合手势
@@ -57,8 +83,10 @@ class ImageViewer(QGraphicsView):
         monument = ang / 500 + 1
         
         if ang > 2:
+            self.beginInteractiveZoom()
             self.zoomIn(factor=monument)
         elif ang < -2:
+            self.beginInteractiveZoom()
             self.zoomOut(factor=monument)
 
     # 处理捏合手势
@@ -68,6 +96,7 @@ class ImageViewer(QGraphicsView):
             if pinch:
                 changeFlags = pinch.changeFlags()
                 if changeFlags & pinch.ScaleFactorChanged:
+                    self.beginInteractiveZoom()
                     factor = pinch.scaleFactor()
                     if factor > 1.0:
                         self.zoomIn(factor=factor)
@@ -94,6 +123,76 @@ class ImageViewer(QGraphicsView):
             self.fitInView(self.pixmapItem, Qt.KeepAspectRatio)
         else:
             self.resetTransform()
+        self.__updateScaledPixmap()
+
+    def beginInteractiveZoom(self):
+        """ 进入交互缩放，停止操作一段时间后自动平滑重绘 """
+        if not self.interactiveZooming:
+            self.interactiveZooming = True
+            self.pixmapItem.setTransformationMode(Qt.FastTransformation)
+            self.setRenderHint(QPainter.SmoothPixmapTransform, False)
+        self.settleTimer.start()
+
+    def endInteractiveZoom(self):
+        """ 结束交互缩放，生成当前比例的缓存图片平滑重绘 """
+        self.settleTimer.stop()
+        if self.interactiveZooming:
+            self.interactiveZooming = False
+            self.pixmapItem.setTransformationMode(Qt.SmoothTransformation)
+            self.setRenderHint(QPainter.SmoothPixmapTransform, True)
+        self.__updateScaledPixmap(build=True)
+        self.viewport().update()
+
+    def __updateScaledPixmap(self, build=False):
+        """ 缩小显示时换成预先缩放好的图片，避免每帧都对原图平滑缩放
+
+        缩放原图较慢，只在 build 为 True（停止操作后）时生成，之前先绘制原图
+        """
+        if self.pixmap.isNull():
+            return
+        transform = self.transform()
+        scale = math.hypot(transform.m11(), transform.m12())
+        key = int(scale * 100)
+        if key >= 90 or not self.useScaledPixmapCache:
+            # 接近或大于原图尺寸时直接使用原图
+            key = None
+        if self.interactiveZooming:
+            # 手势中不做平滑缩放，放大超过当前预缩放图片的分辨率时改用原图
+            if self.scaledPixmapKey is None or (key is not None and key <= self.scaledPixmapKey):
+                return
+            key = None
+        if key == self.scaledPixmapKey:
+            return
+        scaled = self.scaledPixmapCache.get(key)
+        if key is not None and scaled is None and not build:
+            # 切换图片、调整窗口时不阻塞，先绘制原图，稍后生成
+            self.settleTimer.start()
+            key = None
+            if self.scaledPixmapKey is None:
+                return
+        self.scaledPixmapKey = key
+
+        if key is None:
+            self.pixmapItem.setPixmap(self.pixmap)
+            self.pixmapItem.setTransform(QTransform())
+            return
+        if scaled is None:
+            if len(self.scaledPixmapCache) >= self.maxScaledPixmaps:
+                del self.scaledPixmapCache[next(iter(self.scaledPixmapCache))]
+            # 多保留 1% 的分辨率，避免显示时再被放大
+            scaled = self.pixmap.scaled(
+                max(1, math.ceil(self.pixmap.width() * (key + 1) / 100)),
+                max(1, math.ceil(self.pixmap.height() * (key + 1) / 100)),
+                Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+            self.scaledPixmapCache[key] = scaled
+        self.pixmapItem.setPixmap(scaled)
+        self.pixmapItem.setTransform(QTransform.fromScale(
+            self.pixmap.width() / scaled.width(), self.pixmap.height() / scaled.height()))
+
+    def setScaledPixmapCacheEnabled(self, enabled: bool):
+        """ 关闭时始终直接绘制原图 """
+        self.useScaledPixmapCache = enabled
+        self.__updateScaledPixmap()
 
     def setImage(self, imagePath: Union[str, QPixmap]):
         """ 设置显示的图片 """
@@ -102,7 +201,10 @@ class ImageViewer(QGraphicsView):
             self.pixmap = QPixmap(imagePath)
         else:
             self.pixmap = imagePath
+        self.scaledPixmapCache = {}
+        self.scaledPixmapKey = None
         self.pixmapItem.setPixmap(self.pixmap)
+        self.pixmapItem.setTransform(QTransform())
 
         # 调整图片大小
         if not self.keepRatioWhenSwitchImage:
@@ -110,6 +212,21 @@ class ImageViewer(QGraphicsView):
         else:
             self.renewTransform()
     
+    def setClippingMask(self, mask: QImage):
+        """ 设置溢出蒙版，mask 为缩小后的图，拉伸到图片大小显示 """
+        if mask is None or mask.isNull() or self.pixmap.isNull():
+            self.clippingItem.setPixmap(QPixmap())
+            self.clippingItem.setVisible(False)
+            return
+        self.clippingItem.setPixmap(QPixmap.fromImage(mask))
+        self.clippingItem.setTransform(QTransform.fromScale(
+            self.pixmap.width() / mask.width(), self.pixmap.height() / mask.height()))
+        self.clippingItem.setVisible(self.showClipping)
+
+    def setShowClipping(self, show: bool):
+        self.showClipping = show
+        self.clippingItem.setVisible(show and not self.clippingItem.pixmap().isNull())
+
     def resetAndFit(self):
         self.resetTransform()
         self.setSceneRect(QRectF(self.pixmap.rect()))
@@ -117,6 +234,7 @@ class ImageViewer(QGraphicsView):
         self.displayedImageSize = self.pixmap.size()*ratio
         if ratio < 1:
             self.fitInView(self.pixmapItem, Qt.KeepAspectRatio)
+        self.__updateScaledPixmap()
 
     def renewTransform(self):
         h = self.horizontalScrollBar().value()
@@ -145,6 +263,7 @@ class ImageViewer(QGraphicsView):
         
         self.horizontalScrollBar().setValue(h)
         self.verticalScrollBar().setValue(v)
+        self.__updateScaledPixmap()
 
     def resetTransform(self):
         """ 重置变换 """
@@ -210,6 +329,12 @@ class ImageViewer(QGraphicsView):
         # 还原 anchor
         self.setTransformationAnchor(self.AnchorUnderMouse)
 
+        # 非手势缩放时立即换成当前比例的图片
+        self.__updateScaledPixmap()
+
+        if w * factor * self.devicePixelRatioF() > pw:
+            self.zoomedPastPixmap.emit()
+
     def zoomOut(self, factor=1/1.1, viewAnchor=QGraphicsView.AnchorUnderMouse):
         """ 缩小图像 """
         if self.zoomInFactors == 1.0 and not self.__isEnableDrag():
@@ -243,4 +368,7 @@ class ImageViewer(QGraphicsView):
         self.__setDragEnabled(self.__isEnableDrag())
 
         # 还原 anchor
-        self.setTransformationAnchor(self.AnchorUnderMouse)
\ No newline at end of file
+        self.setTransformationAnchor(self.AnchorUnderMouse)
+
+        # 非手势缩放时立即换成当前比例的图片
+        self.__updateScaledPixmap()
\ No newline at end of file
@@ -1,20 +1,47 @@
 import os
 import shutil
 import sys
+import time
 
 from pathlib import Path
 from typing import Dict, Any
-from PyQt5 import uic
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtWidgets import (
-    QMainWindow, QFileDialog, QLabel
+    QApplication, QMainWindow, QFileDialog, QLabel
 )
 from PyQt5.QtGui import QPixmap
 
 from .image_viewer import ImageViewer
 from .image_list import ImageList
+from .histogram_view import HistogramView
 from service.image_cache import ImageCache
-from service.util import calc_exif_number, NORMAL_FORMAT, RAW_FORMAT
+from service.exporter import ExportWorker
+from service.session import save_session_async, load_session, SessionValidator, SAVE_TIMEOUT
+from service.util import calc_exif_number, supported_formats
+
+# 设置该环境变量时输出启动耗时并在显示第一张图后退出，见 benchmark/startup.py
+STARTUP_BENCH = os.environ.get('PICV_STARTUP_BENCH') is not None
+
+def load_ui(window: QMainWindow, ui_path: str):
+    """ 使用预编译的 ui 类初始化窗口，ui 文件更新时重新编译，失败则回退到 loadUi """
+    py_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ui_main_window.py')
+    try:
+        if not os.path.exists(py_path) or os.path.getmtime(py_path) < os.path.getmtime(ui_path):
+            from PyQt5 import uic
+            print('compile ui:', ui_path)
+            with open(py_path + '.part', 'w', encoding='utf-8') as f:
+                uic.compileUi(ui_path, f)
+            os.replace(py_path + '.part', py_path)
+        from .ui_main_window import Ui_MainWindow
+    except Exception as e:
+        print('precompiled ui not available:', e)
+        from PyQt5 import uic
+        uic.loadUi(ui_path, window, package='controller')
+        return
+    ui = Ui_MainWindow()
+    ui.setupUi(window)
+    for name, value in vars(ui).items():
+        setattr(window, name, value)
 
 class MainWindow(QMainWindow):
     def __init__(self, dir_path=None):
@@ -23,17 +50,24 @@ class MainWindow(QMainWindow):
         self.imageList: ImageList = None
         self.imageViewer: ImageViewer = None
         main_file = getattr(sys.modules['__main__'], '__file__', None)
-        uic.loadUi(os.path.join(os.path.dirname(os.path.abspath(main_file)),'ui','main_window.ui'), self, package='controller')
+        load_ui(self, os.path.join(os.path.dirname(os.path.abspath(main_file)),'ui','main_window.ui'))
 
         self.infoLabel = QLabel('')
         self.infoLabel.setAlignment(Qt.AlignCenter)
         self.statusBar().addPermanentWidget(self.infoLabel, 1)
+        self.exportLabel = QLabel('')
+        self.statusBar().addPermanentWidget(self.exportLabel)
+        self.histogramView = HistogramView()
+        self.histogramView.setVisible(False)
+        self.statusBar().addPermanentWidget(self.histogramView)
 
         # connect signals
         self.actionOpen.triggered.connect(lambda: self.open())
         self.actionOpenPath.triggered.connect(lambda: self.open_path())
         self.actionOpenLast.triggered.connect(lambda: self.open_last())
         self.actionReloadPath.triggered.connect(lambda: self.reload_path())
+        self.actionExport.triggered.connect(lambda: self.export())
+        self.actionExportMove.triggered.connect(lambda: self.export(move=True))
         self.actionClose.triggered.connect(lambda: self._close())
         self.actionDelete.triggered.connect(lambda: self.delete())
         self.actionFit.triggered.connect(lambda: self.fit())
@@ -43,11 +77,13 @@ class MainWindow(QMainWindow):
         self.actionPrevious.triggered.connect(lambda: self.previousImage())
         self.actionLast.triggered.connect(lambda: self.lastImage())
         self.actionSortByFormat.triggered.connect(lambda x: self._sort_by_format(x))
+        self.actionHistogram.triggered.connect(lambda x: self.histogramView.setVisible(x))
+        self.actionClipping.triggered.connect(lambda x: self.imageViewer.setShowClipping(x))
         self.imageList.itemSelectionChanged.connect(self.selectChanged)
+        self.imageViewer.zoomedPastPixmap.connect(self.load_full_image)
     
         # define consts
         self.APP_NAME = 'picv'
-        self.VALID_FORMAT = [*NORMAL_FORMAT, *RAW_FORMAT]
         self.NUMBER_OF_CACHED_IMAGES = 10
 
         # define props
@@ -58,23 +94,53 @@ class MainWindow(QMainWindow):
         self.file_list: list[str] = []
         self.file_list_len = 0
         self.image_cache = ImageCache()
+        # 图片进入缓存后不再需要上次的预览，避免之后切换回来时闪过旧预览
+        self.image_cache.on_cached = lambda image_name: self.session_previews.pop(image_name, None)
         self.sort_by_format = False
+        self.export_worker: ExportWorker = None
+        self.window_painted = False
+        self.session_previews: dict[str, str] = {}
+        self.session_validator: SessionValidator = None
+        self.session_saver = None
+        self.NUMBER_OF_SESSION_PREVIEWS = 2
 
         # process dirPath
+        # 先显示窗口，再扫描目录
         if dir_path is not None:
-            if os.path.isdir(dir_path):
-                self.open_path(dir_path)
-            elif os.path.isfile(dir_path):
-                self.open(dir_path)
-            else:
-                print('file not exist!')
-                pass
+            QTimer.singleShot(0, lambda: self.open_any(dir_path))
+
+    def open_any(self, dir_path):
+        if os.path.isdir(dir_path):
+            self.open_path(dir_path)
+        elif os.path.isfile(dir_path):
+            self.open(dir_path)
+        else:
+            print('file not exist!')
+
+    def paintEvent(self, e):
+        super().paintEvent(e)
+        if not self.window_painted:
+            self.window_painted = True
+            if STARTUP_BENCH:
+                print(f'bench window {time.time():.6f}', flush=True)
+
+    def closeEvent(self, e):
+        if self.export_worker is not None and self.export_worker.isRunning():
+            # 中断导出，等待正在拷贝的文件清理临时文件
+            self.export_worker.stop()
+            self.export_worker.wait()
+        self.save_last()
+        if self.session_saver is not None:
+            # 预览生成本身有时间上限，这里再留一些写文件的时间
+            self.session_saver.join(SAVE_TIMEOUT * 2)
+        super().closeEvent(e)
     
     ##### file process start #####
-    def init_dir(self, dir_path, only_sort=False):
-        all_items = os.listdir(dir_path)
-        valid_ext = set(self.VALID_FORMAT)
-        file_list = [f for f in all_items if os.path.isfile(os.path.join(dir_path, f)) and os.path.splitext(f)[1].lower() in valid_ext]
+    def init_dir(self, dir_path, only_sort=False, file_list=None):
+        if file_list is None:
+            all_items = os.listdir(dir_path)
+            valid_ext = set(supported_formats())
+            file_list = [f for f in all_items if os.path.isfile(os.path.join(dir_path, f)) and os.path.splitext(f)[1].lower() in valid_ext]
         
         if self.sort_by_format:
             file_list.sort(key=lambda x: (Path(x).suffix.lower(), x))
@@ -88,20 +154,22 @@ class MainWindow(QMainWindow):
         self.cur_dir = dir_path
         self.file_list = file_list
         self.file_list_len = len(file_list)
-        
-        # 缩略图
-        self.imageList.set_list(dir_path, file_list)
 
         if not only_sort:
+            # 先清空缓存范围，缩略图等到确定哪些图片会完整解码后再生成
             self.image_cache.init(dir_path)
             self.last_image_name = None
+            self.session_previews = {}
             # resize at first image
             self.imageViewer.keepRatioWhenSwitchImage = False
         
+        # 缩略图
+        self.imageList.set_list(dir_path, file_list)
+
 
     def open(self, file_path=None):
         if file_path is None:
-            file_path, _ = QFileDialog.getOpenFileName(self, "Open Image", "", f"Image Files ({' '.join([f'*{ext}' for ext in self.VALID_FORMAT])})")
+            file_path, _ = QFileDialog.getOpenFileName(self, "Open Image", "", f"Image Files ({' '.join([f'*{ext}' for ext in supported_formats()])})")
             if file_path == '':
                 return
         self.init_dir(os.path.dirname(file_path)) 
@@ -122,10 +190,62 @@ class MainWindow(QMainWindow):
         self.select(self.file_list[0])
         self.cache_files()
 
+    def write_last(self):
+        if self.cur_dir is None or self.selected_image_name is None:
+            return
+        with open(os.path.join(self.imageList.THUMBNAIL_DIR, 'last'), 'w', encoding='utf-8') as f:
+            f.write(os.path.join(self.cur_dir, self.selected_image_name))
+
+    def save_last(self):
+        if self.cur_dir is None or self.selected_image_name not in self.image_name2idx:
+            return
+        self.write_last()
+
+        # 保存当前及相邻已解码图片的预览，下次打开时先显示预览
+        cur_idx = self.image_name2idx[self.selected_image_name]
+        images = {}
+        for i in sorted(range(max(0, cur_idx - self.NUMBER_OF_SESSION_PREVIEWS), min(self.file_list_len, cur_idx + self.NUMBER_OF_SESSION_PREVIEWS + 1)), key=lambda x: abs(x - cur_idx)):
+            image = self.image_cache.image_cache.get(self.file_list[i])
+            if image is not None:
+                images[self.file_list[i]] = image
+        if self.session_saver is not None:
+            # 两次保存写同一目录，等上一次完成
+            self.session_saver.join()
+        # 缩放和编码在后台进行，不阻塞界面
+        self.session_saver = save_session_async(os.path.join(self.imageList.THUMBNAIL_DIR, 'session'), self.cur_dir, list(self.file_list),
+                                                self.selected_image_name, images, self.imageViewer.size() * self.devicePixelRatioF())
+
     def open_last(self):
         with open(os.path.join(self.imageList.THUMBNAIL_DIR, 'last'), 'r', encoding='utf-8') as f:
             last = f.read()
-        self.open(last)
+        session = load_session(os.path.join(self.imageList.THUMBNAIL_DIR, 'session'))
+        if session is None or session['selected'] not in session['files'] or os.path.join(session['dir'], session['selected']) != last:
+            self.open(last)
+            return
+
+        # 直接使用上次的文件列表和预览，后台再检查目录是否有变化
+        self.init_dir(session['dir'], file_list=list(session['files']))
+        self.session_previews = session['previews']
+        self.select(session['selected'])
+        self.cache_files()
+
+        if self.session_validator is not None:
+            self.session_validator.wait()
+        self.session_validator = SessionValidator(session, set(supported_formats()))
+        self.session_validator.validated.connect(lambda dir_changed, changed: self._on_session_validated(session['dir'], dir_changed, changed))
+        self.session_validator.start()
+
+    def _on_session_validated(self, dir_path, dir_changed, changed_names):
+        if dir_path != self.cur_dir:
+            return
+        for file_name in changed_names:
+            self.session_previews.pop(file_name, None)
+        if dir_changed:
+            print('directory changed, reload')
+            if self.selected_image_name in self.image_name2idx and os.path.isfile(os.path.join(self.cur_dir, self.selected_image_name)):
+                self.open(os.path.join(self.cur_dir, self.selected_image_name))
+            else:
+                self.open_path(self.cur_dir)
 
     def reload_path(self):
         if self.selected_image_name is None:
@@ -156,10 +276,41 @@ class MainWindow(QMainWindow):
         # self.selected_image_name = None # 防止last读到空
         self.select(self.file_list[cur_idx])
     
+    def export(self, move=False):
+        if self.cur_dir is None or self.file_list_len == 0:
+            return
+        if self.export_worker is not None and self.export_worker.isRunning():
+            print('export is running!')
+            return
+        target_dir = QFileDialog.getExistingDirectory(self, "Export To", "")
+        if target_dir == '' or os.path.abspath(target_dir) == os.path.abspath(self.cur_dir):
+            return
+        file_paths = [os.path.join(self.cur_dir, file_name) for file_name in self.file_list]
+
+        self.export_worker = ExportWorker(file_paths, target_dir, move=move)
+        self.export_worker.progress.connect(self._on_export_progress)
+        self.export_worker.finished_all.connect(lambda ok, fail: self._on_export_done(ok, fail, move))
+        self.export_worker.start()
+
+    def _on_export_progress(self, done_bytes, total_bytes, done_files, total_files, speed):
+        percent = done_bytes * 100 // total_bytes if total_bytes > 0 else 100
+        self.exportLabel.setText(f'导出 {done_files}/{total_files} {percent}% {speed / 1024 / 1024:.1f}MB/s')
+
+    def _on_export_done(self, ok_count, fail_count, move):
+        self.exportLabel.setText(f'导出完成 {ok_count} 项' + (f'，失败 {fail_count} 项' if fail_count > 0 else ''))
+        if move and self.cur_dir is not None:
+            # 文件已被移走，重新扫描目录
+            cur_dir = self.cur_dir
+            self._close()
+            self.open_path(cur_dir)
+
     def _close(self):
+        self.save_last()
         self.imageList.clear()
         self.imageViewer.pixmap = QPixmap()
         self.imageViewer.pixmapItem.setPixmap(self.imageViewer.pixmap)
+        self.imageViewer.setClippingMask(None)
+        self.histogramView.setStats(None)
         self.image_cache.clear_cache()
         self.cur_dir: str = None
         self.selected_image_name: str = None
@@ -197,8 +348,8 @@ class MainWindow(QMainWindow):
     def select(self, image_name):
         self.imageList.item(self.image_name2idx[image_name]).setSelected(True)
         self.imageList.scrollToItem(self.imageList.selectedItems()[0])
-        with open(os.path.join(self.imageList.THUMBNAIL_DIR, 'last'), 'w', encoding='utf-8') as f:
-            f.write(os.path.join(self.cur_dir, self.selected_image_name))
+        # 目录扫描已在窗口显示之后进行，这里写入不影响启动
+        self.write_last()
 
     def selectChanged(self):
         if len(self.imageList.selectedItems()) == 0:
@@ -209,15 +360,33 @@ class MainWindow(QMainWindow):
         self.display_image(cur)
         self.cache_files()
 
-    def display_image(self, image_name: str):
-        def set_image(image: QPixmap, exif_tags: Dict[str, Any]):
-            self.imageViewer.setImage(image)
-            # keep current ratio
-            self.imageViewer.keepRatioWhenSwitchImage = True
+    def set_image(self, image: QPixmap, exif_tags: Dict[str, Any], stats: Dict[str, Any]):
+        self.imageViewer.setImage(image)
+        self.imageViewer.setClippingMask(stats['mask'] if stats is not None else None)
+        self.histogramView.setStats(stats)
+        # keep current ratio
+        self.imageViewer.keepRatioWhenSwitchImage = True
+
+        self.setWindowTitle(f'{self.APP_NAME} - {self.selected_image_name}')
+        self.infoLabel.setText(self.info_text(exif_tags))
+        if STARTUP_BENCH:
+            print(f'bench image {time.time():.6f}', flush=True)
+            QTimer.singleShot(0, QApplication.quit)
 
+    def display_image(self, image_name: str):
+        if image_name not in self.image_cache.image_cache and image_name in self.session_previews:
+            # 解码完成前先显示上次保存的预览
+            self.imageViewer.setImage(QPixmap(self.session_previews[image_name]))
+            self.imageViewer.setClippingMask(None)
+            self.histogramView.setStats(None)
             self.setWindowTitle(f'{self.APP_NAME} - {self.selected_image_name}')
-            self.infoLabel.setText(self.info_text(exif_tags))
-        self.image_cache.request_image(image_name, set_image)
+        self.image_cache.request_image(image_name, self.set_image)
+
+    def load_full_image(self):
+        # 当前显示的是二级缓存的屏幕分辨率图片时，放大后再解码原图，保持当前缩放比例
+        if self.selected_image_name is None:
+            return
+        self.image_cache.request_full(self.selected_image_name, self.set_image)
     
     def info_text(self, exif_tags: Dict[str, Any]):
         text = f"当前第{self.image_name2idx[self.selected_image_name] + 1}项，共{self.file_list_len}项;"
@@ -1,11 +1,16 @@
 import argparse
 import sys
 
-from PyQt5.QtWidgets import QApplication
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'prewarm':
+        # 无界面预生成缩略图
+        from service.prewarm import main as prewarm_main
+        sys.exit(prewarm_main(sys.argv[2:]))
 
-from controller.main_window import MainWindow
+    from PyQt5.QtWidgets import QApplication
+
+    from controller.main_window import MainWindow
 
-if __name__ == '__main__':
     app = QApplication(sys.argv)
 
     parser = argparse.ArgumentParser(description='Open pic viewer')
@@ -0,0 +1,122 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, Any
+
+from PyQt5.QtCore import QSize
+from PyQt5.QtGui import QImage
+
+from service.util import read_image
+
+# 保留最近解码的几张图，供稍后到达的其他请求复用
+RECENT_RESULTS = 3
+
+class DecodePipeline:
+    """ 缩略图和大图共用的解码入口，同一路径同一时间只解码一次 """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inflight: dict[str, Future] = {}
+        self.recent: OrderedDict[str, tuple[QImage, Dict[str, Any]]] = OrderedDict()
+        self.consumers: list[Callable[[str, QImage, Dict[str, Any]], None]] = []
+        # 大图缓存即将完整解码的路径，None 表示尚未确定
+        self.window: frozenset[str] = None
+
+        # 统计
+        self.decoded = 0
+        self.joined = 0  # 等待同一路径正在进行的解码
+        self.reused = 0  # 直接使用最近的解码结果
+        self.scaled = 0  # 只需要小图时单独的缩小解码
+        self.shared = 0  # consumer 使用完整解码的结果，省去一次缩小解码
+
+    def add_consumer(self, consumer: Callable[[str, QImage, Dict[str, Any]], None]):
+        """ 每次实际解码并返回结果后，在解码线程中调用 consumer，consumer 应尽快返回 """
+        self.consumers.append(consumer)
+
+    def set_window(self, file_paths):
+        """ 设置即将完整解码的图片，这些图片的缩略图等待 consumer 生成 """
+        self.window = None if file_paths is None else frozenset(os.path.abspath(p) for p in file_paths)
+
+    def will_decode(self, file_path: str):
+        window = self.window
+        return window is None or os.path.abspath(file_path) in window
+
+    def record_shared(self, file_path: str):
+        """ consumer 使用完整解码结果代替了一次解码时调用 """
+        with self.lock:
+            self.shared += 1
+            self._print_stats('share', file_path)
+
+    def decode(self, file_path: str, size: QSize = None):
+        """ 返回 (image, exif_tags)，解码失败时抛出异常
+
+        指定 size 时如果没有可复用的完整解码，则直接用解码器缩小解码，exif_tags 为 None
+        """
+        import exifread
+        file_path = os.path.abspath(file_path)
+        with self.lock:
+            if file_path in self.recent:
+                self.recent.move_to_end(file_path)
+                self.reused += 1
+                self._print_stats('reuse', file_path)
+                return self.recent[file_path]
+            future = self.inflight.get(file_path)
+            owner = future is None
+            scaled = owner and size is not None
+            if scaled:
+                self.scaled += 1
+            elif owner:
+                future = Future()
+                self.inflight[file_path] = future
+            else:
+                self.joined += 1
+                self._print_stats('join', file_path)
+
+        if scaled:
+            return read_image(file_path, size), None
+        if not owner:
+            return future.result()
+
+        try:
+            image = read_image(file_path)
+            if image.isNull():
+                raise IOError(f'decode failed: {file_path}')
+            with open(file_path, 'rb') as f:
+                tags = exifread.process_file(f)
+            result = (image, tags)
+            with self.lock:
+                self.decoded += 1
+                self.recent[file_path] = result
+                while len(self.recent) > RECENT_RESULTS:
+                    self.recent.popitem(last=False)
+            future.set_result(result)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[file_path]
+
+        # 结果已发布，等待者不必等 consumer
+        for consumer in self.consumers:
+            try:
+                consumer(file_path, image, tags)
+            except Exception as e:
+                print('decode consumer failed:', e)
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.recent.clear()
+        self.window = None
+
+    def stats(self):
+        return {'decoded': self.decoded, 'joined': self.joined, 'reused': self.reused, 'scaled': self.scaled, 'shared': self.shared}
+
+    def _print_stats(self, kind, file_path):
+        print(f'decode {kind}: {os.path.basename(file_path)}, '
+              f'decoded {self.decoded}, avoided {self.joined + self.reused + self.shared}')
+
+
+pipeline = DecodePipeline()
@@ -0,0 +1,241 @@
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+# 每个设备同时进行的拷贝数，避免机械硬盘/读卡器来回寻道
+PER_DEVICE_CONCURRENCY = 2
+MAX_WORKERS = 4
+CHUNK_SIZE = 8 * 1024 * 1024
+PROGRESS_INTERVAL = 0.2
+
+
+def _device_of(path):
+    # 目标文件还不存在时取其所在目录的设备号
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return os.stat(path).st_dev
+
+
+def _zero_copy(fd_in, fd_out, size, on_progress):
+    """ 优先使用内核态拷贝 copy_file_range / sendfile，失败则回退到普通读写 """
+    offset = 0
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    sendfile = getattr(os, 'sendfile', None)
+    while offset < size:
+        count = min(CHUNK_SIZE, size - offset)
+        sent = 0
+        if copy_file_range is not None:
+            try:
+                sent = copy_file_range(fd_in, fd_out, count)
+            except OSError:
+                sent = 0
+            if sent == 0:
+                # 跨文件系统或不支持时回退
+                copy_file_range = None
+        if sent == 0 and copy_file_range is None and sendfile is not None:
+            try:
+                # macOS 的 sendfile 只支持 socket 作为目标，这里会抛错并回退
+                sent = sendfile(fd_out, fd_in, offset, count)
+                # sendfile 指定 offset 时不移动输入文件的读取位置
+                os.lseek(fd_in, offset + sent, os.SEEK_SET)
+            except OSError:
+                sent = 0
+            if sent == 0:
+                sendfile = None
+        if sent == 0 and copy_file_range is None and sendfile is None:
+            data = os.read(fd_in, count)
+            sent = os.write(fd_out, data) if data else 0
+        if sent == 0:
+            raise IOError('unexpected end of file')
+        offset += sent
+        on_progress(sent)
+
+
+def _fsync_fd(fd):
+    """ 确保数据写入磁盘，macOS 的 fsync 不会刷新磁盘缓存，需要 F_FULLFSYNC """
+    try:
+        import fcntl
+        if hasattr(fcntl, 'F_FULLFSYNC'):
+            fcntl.fcntl(fd, fcntl.F_FULLFSYNC)
+            return
+    except (ImportError, OSError):
+        pass
+    os.fsync(fd)
+
+
+def _fsync_file(file_path):
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        _fsync_fd(fd)
+        # 丢弃页缓存，之后的校验从磁盘读取
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def _fsync_dir(dir_path):
+    # 改名后同步目录项，Windows 不支持打开目录，跳过
+    try:
+        fd = os.open(dir_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        _fsync_fd(fd)
+    finally:
+        os.close(fd)
+
+
+def file_checksum(file_path):
+    h = hashlib.blake2b()
+    with open(file_path, 'rb') as f:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+class ExportWorker(QThread):
+    progress = pyqtSignal(int, int, int, int, float)  # done_bytes, total_bytes, done_files, total_files, bytes/s
+    file_done = pyqtSignal(str, bool, str)  # src_path, ok, message
+    finished_all = pyqtSignal(int, int)  # ok_count, fail_count
+
+    def __init__(self, file_paths: list[str], target_dir: str, move=False, verify=True):
+        super().__init__()
+        self.file_paths = file_paths
+        self.target_dir = target_dir
+        self.move = move
+        self.verify = verify
+        self.running = True
+
+        self._lock = threading.Lock()
+        self._device_locks: dict[int, threading.BoundedSemaphore] = {}
+        self._done_bytes = 0
+        self._done_files = 0
+        self._total_bytes = 0
+        self._start_time = 0
+        self._last_emit = 0
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        sizes = {}
+        for path in self.file_paths:
+            try:
+                sizes[path] = os.path.getsize(path)
+            except OSError:
+                sizes[path] = 0
+        self._total_bytes = sum(sizes.values())
+        self._start_time = time.monotonic()
+        os.makedirs(self.target_dir, exist_ok=True)
+
+        ok_count = 0
+        fail_count = 0
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {executor.submit(self._export_one, path, sizes[path]): path for path in self.file_paths}
+            for future in as_completed(futures):
+                src_path = futures[future]
+                try:
+                    future.result()
+                    ok_count += 1
+                    self.file_done.emit(src_path, True, '')
+                except Exception as e:
+                    fail_count += 1
+                    print(f'export failed: {src_path}, {e}')
+                    self.file_done.emit(src_path, False, str(e))
+                with self._lock:
+                    self._done_files += 1
+                self._emit_progress(force=True)
+        self.finished_all.emit(ok_count, fail_count)
+
+    def _device_lock(self, device):
+        with self._lock:
+            if device not in self._device_locks:
+                self._device_locks[device] = threading.BoundedSemaphore(PER_DEVICE_CONCURRENCY)
+            return self._device_locks[device]
+
+    def _on_bytes(self, count):
+        if not self.running:
+            # 取消时中断正在进行的拷贝，临时文件会被删除
+            raise RuntimeError('canceled')
+        self._add_bytes(count)
+
+    def _add_bytes(self, count):
+        with self._lock:
+            self._done_bytes += count
+        self._emit_progress()
+
+    def _emit_progress(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_emit < PROGRESS_INTERVAL:
+                return
+            self._last_emit = now
+            done_bytes = self._done_bytes
+            done_files = self._done_files
+        elapsed = max(now - self._start_time, 1e-6)
+        self.progress.emit(done_bytes, self._total_bytes, done_files, len(self.file_paths), done_bytes / elapsed)
+
+    def _export_one(self, src_path, size):
+        if not self.running:
+            raise RuntimeError('canceled')
+        dst_path = os.path.join(self.target_dir, os.path.basename(src_path))
+        if os.path.exists(dst_path):
+            # 已存在且内容一致视为已导出
+            if os.path.getsize(dst_path) == size:
+                if self.move:
+                    # 删除源文件前确保目标已落盘
+                    _fsync_file(dst_path)
+                    _fsync_dir(self.target_dir)
+                if file_checksum(dst_path) == file_checksum(src_path):
+                    self._add_bytes(size)
+                    if self.move:
+                        os.remove(src_path)
+                    return
+            raise FileExistsError(f'{dst_path} already exists')
+
+        src_dev = _device_of(src_path)
+        dst_dev = _device_of(self.target_dir)
+        if self.move and src_dev == dst_dev:
+            # 同一设备直接改名即可
+            os.rename(src_path, dst_path)
+            _fsync_dir(self.target_dir)
+            self._add_bytes(size)
+            return
+
+        # 按设备号顺序加锁，避免互相等待
+        locks = [self._device_lock(dev) for dev in sorted(set([src_dev, dst_dev]))]
+        for lock in locks:
+            lock.acquire()
+        try:
+            tmp_path = dst_path + '.part'
+            try:
+                with open(src_path, 'rb') as fsrc, open(tmp_path, 'wb') as fdst:
+                    _zero_copy(fsrc.fileno(), fdst.fileno(), size, self._on_bytes)
+                    _fsync_fd(fdst.fileno())
+                if self.verify:
+                    _fsync_file(tmp_path)
+                    if file_checksum(src_path) != file_checksum(tmp_path):
+                        raise IOError(f'checksum mismatch: {src_path}')
+                os.replace(tmp_path, dst_path)
+                _fsync_dir(self.target_dir)
+            except:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+        if self.move:
+            os.remove(src_path)
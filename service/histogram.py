@@ -0,0 +1,47 @@
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage, QTransform
+
+# 在缩小后的图片上计算，避免处理原图
+STATS_SIZE = 256
+CLIP_HIGH = 254
+CLIP_LOW = 1
+HIGHLIGHT_COLOR = (255, 0, 0, 160)
+SHADOW_COLOR = (0, 80, 255, 160)
+
+
+def compute_stats(image: QImage):
+    """ 计算 RGB 及亮度直方图、高光/暗部溢出比例和溢出区域蒙版 """
+    import numpy as np
+    small = image.scaled(STATS_SIZE, STATS_SIZE, Qt.KeepAspectRatio, Qt.FastTransformation)
+    small = small.convertToFormat(QImage.Format_RGB888)
+    width, height = small.width(), small.height()
+    ptr = small.constBits()
+    ptr.setsize(small.sizeInBytes())
+    # 每行可能有对齐填充
+    pixels = np.frombuffer(ptr, np.uint8).reshape(height, small.bytesPerLine())[:, :width * 3].reshape(height, width, 3)
+
+    luma = (pixels[..., 0].astype(np.uint16) * 77 + pixels[..., 1].astype(np.uint16) * 150 + pixels[..., 2].astype(np.uint16) * 29) >> 8
+    hist = np.stack([np.bincount(pixels[..., c].ravel(), minlength=256) for c in range(3)]
+                    + [np.bincount(luma.ravel(), minlength=256)])
+
+    channel_max = pixels.max(axis=2)
+    highlight = channel_max >= CLIP_HIGH
+    shadow = channel_max <= CLIP_LOW
+    mask = np.zeros((height, width, 4), np.uint8)
+    mask[highlight] = HIGHLIGHT_COLOR
+    mask[shadow] = SHADOW_COLOR
+    mask_image = QImage(mask.data, width, height, width * 4, QImage.Format_RGBA8888).copy()
+
+    return {
+        'hist': hist,
+        'highlight': float(highlight.mean()),
+        'shadow': float(shadow.mean()),
+        'mask': mask_image,
+    }
+
+
+def transform_stats(stats, transform: QTransform):
+    """ 图片旋转后同步旋转蒙版 """
+    if stats is None:
+        return None
+    return {**stats, 'mask': stats['mask'].transformed(transform)}
@@ -1,14 +1,104 @@
 import os
 import queue
-import exifread
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable, Dict, Any
-from PyQt5.QtCore import QThread, QObject, pyqtSignal, pyqtSlot
-from PyQt5.QtGui import QImage, QPixmap, QTransform
+from PyQt5.QtCore import Qt, QThread, QObject, QSize, QBuffer, QByteArray, QIODevice, pyqtSignal, pyqtSlot
+from PyQt5.QtGui import QImage, QPixmap, QTransform, QGuiApplication
 
-from service.util import read_image
+from service.decode_pipeline import pipeline
+from service.histogram import compute_stats, transform_stats
+
+COMPRESSED_CACHE_MAX_BYTES = 256 * 1024 * 1024
+COMPRESSED_CACHE_QUALITY = 90
+# 等待压缩的原图最多保留几张，快速翻页时超出的直接丢弃，避免内存无限增长
+COMPRESSED_CACHE_MAX_PENDING = 2
+# exif 中的内嵌缩略图不需要保留
+EXIF_THUMBNAIL_TAGS = ('JPEGThumbnail', 'TIFFThumbnail')
+
+def _tags_size(exif_tags: Dict[str, Any]):
+    """ 粗略估计 exif 占用的内存 """
+    return sum(len(key) + len(str(getattr(tag, 'values', tag))) for key, tag in exif_tags.items())
+
+class CompressedCache:
+    """ 二级缓存，被淘汰的图片缩放到屏幕尺寸后以 JPEG 保存在内存中 """
+
+    def __init__(self, max_bytes=COMPRESSED_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.items: OrderedDict[str, tuple[bytes, Dict[str, Any], int]] = OrderedDict()  # data, exif, 占用字节数
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.pending: set[str] = set()
+        # clear 后递增，丢弃清空前提交的压缩结果
+        self.generation = 0
+        # 压缩在后台线程进行，不阻塞界面
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def put(self, file_path: str, image: QImage, exif_tags: Dict[str, Any], max_size: QSize):
+        with self.lock:
+            if file_path in self.items:
+                self.items.move_to_end(file_path)
+                return
+            if file_path in self.pending:
+                return
+            if len(self.pending) >= COMPRESSED_CACHE_MAX_PENDING:
+                print(f'compress cache busy, drop {os.path.basename(file_path)}')
+                return
+            self.pending.add(file_path)
+            generation = self.generation
+        self.executor.submit(self._compress, file_path, image, exif_tags, max_size, generation)
+
+    def _compress(self, file_path: str, image: QImage, exif_tags: Dict[str, Any], max_size: QSize, generation: int):
+        try:
+            with self.lock:
+                if generation != self.generation:
+                    return
+            if image.width() > max_size.width() or image.height() > max_size.height():
+                image = image.scaled(max_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            data = QByteArray()
+            buffer = QBuffer(data)
+            buffer.open(QIODevice.WriteOnly)
+            if not image.save(buffer, 'JPG', COMPRESSED_CACHE_QUALITY):
+                return
+            data = bytes(data)
+            exif_tags = {key: tag for key, tag in exif_tags.items() if key not in EXIF_THUMBNAIL_TAGS}
+            size = len(data) + _tags_size(exif_tags)
+        finally:
+            with self.lock:
+                if generation == self.generation:
+                    self.pending.discard(file_path)
+        with self.lock:
+            if generation != self.generation or file_path in self.items:
+                return
+            self.items[file_path] = (data, exif_tags, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and len(self.items) > 0:
+                _, (_, _, old_size) = self.items.popitem(last=False)
+                self.total_bytes -= old_size
+        print(f'compress cache: {os.path.basename(file_path)} {size // 1024}KB, total {self.total_bytes // 1024 // 1024}MB')
+
+    def __contains__(self, file_path: str):
+        with self.lock:
+            return file_path in self.items
+
+    def get(self, file_path: str):
+        with self.lock:
+            if file_path not in self.items:
+                return None
+            self.items.move_to_end(file_path)
+            data, exif_tags, _ = self.items[file_path]
+            return data, exif_tags
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.total_bytes = 0
+            self.pending = set()
+            self.generation += 1
 
 class CacheWorker(QObject):
-    image_loaded = pyqtSignal(str, QImage, dict)
+    image_loaded = pyqtSignal(str, QImage, dict, bool, object)  # path, image, exif, is_preview, stats
     before_load = pyqtSignal(str)  # 向主线程询问
 
     def __init__(self, file_queue: queue.Queue, do_cache_queue: queue.Queue):
@@ -29,25 +119,46 @@ class CacheWorker(QObject):
             # 等待主线程返回结果
             need_load = self.do_cache_queue.get()
 
-            if need_load:
+            if isinstance(need_load, tuple):
+                # 二级缓存命中，解压内存中的 JPEG（已经旋转过）代替解码原图，放大超过屏幕分辨率时才解码原图
+                print('do decompress:', file_path)
+                data, tags = need_load
+                image = QImage.fromData(data, 'JPG')
+                if not image.isNull():
+                    self.image_loaded.emit(file_path, image, tags, True, self._compute_stats(image))
+            elif need_load:
                 print('do cache:', file_path)
                 try: # 防止读取时被删除
-                    image = read_image(file_path)
-                    # 读取exif
-                    with open(file_path, 'rb') as f:
-                        tags = exifread.process_file(f)
-                    self.image_loaded.emit(file_path, image, tags)
+                    # 与缩略图共用解码结果，同时读取exif
+                    image, tags = pipeline.decode(file_path)
+                    self.image_loaded.emit(file_path, image, tags, False, self._compute_stats(image))
                 except:
                     pass
             self.file_queue.task_done()
 
+    def _compute_stats(self, image: QImage):
+        # 直方图在子线程中计算，不影响切换图片
+        try:
+            return compute_stats(image)
+        except Exception as e:
+            print('compute stats failed:', e)
+            return None
+
 class ImageCache(QObject):
     def __init__(self):
         super().__init__()
         self.image_cache: dict[str, QImage] = {}
         self.exif_cache: dict[str, Dict[str, Any]] = {}
+        self.stats_cache: dict[str, Dict[str, Any]] = {}
+        # 由二级缓存解压得到的屏幕分辨率图片
+        self.preview_set: set[str] = set([])
+        # 需要原图的预览，解码完成后替换
+        self.full_requested: set[str] = set([])
         self.cache_set: set = set([])
         self.requested_file: tuple[str, Callable[[QPixmap], None]] = None
+        # 图片解码完成并放入缓存后调用，参数为文件名
+        self.on_cached: Callable[[str], None] = None
+        self.compressed_cache = CompressedCache()
         
         self.file_queue = queue.Queue()
         self.do_cache_queue = queue.Queue(maxsize=1)
@@ -68,13 +179,19 @@ class ImageCache(QObject):
 
     def clear_cache(self):
         self.cache_set = set([])
+        self.compressed_cache.clear()
+        pipeline.clear()
         del_names = list(self.image_cache.keys())
         for name in del_names:
             print('remove cache:', name)
             del self.image_cache[name]
             del self.exif_cache[name]
+            del self.stats_cache[name]
         self.image_cache = {}
         self.exif_cache = {}
+        self.stats_cache = {}
+        self.preview_set = set([])
+        self.full_requested = set([])
 
     def cache_files(self, valid_names: list[str]):
         print(f'start caching...')
@@ -84,19 +201,29 @@ class ImageCache(QObject):
         for file_name in self.image_cache:
             if file_name not in _valid_names:
                 del_names.append(file_name)
+        screen = QGuiApplication.primaryScreen()
+        max_size = screen.size() * screen.devicePixelRatio()
         for file_name in del_names:
             print('remove cache:', file_name)
+            # 移入二级缓存
+            self.compressed_cache.put(os.path.join(self.cur_dir, file_name), self.image_cache[file_name], self.exif_cache[file_name], max_size)
             del self.image_cache[file_name]
             del self.exif_cache[file_name]
+            del self.stats_cache[file_name]
+            self.preview_set.discard(file_name)
+            self.full_requested.discard(file_name)
 
         cache_set = set([os.path.join(self.cur_dir, file_name) for file_name in valid_names])
         self.cache_set = cache_set
+        # 需要完整解码的图片，缩略图直接使用解码结果
+        pipeline.set_window([file_path for file_path in cache_set
+                             if os.path.basename(file_path) not in self.image_cache and file_path not in self.compressed_cache])
 
         for fileName in valid_names:
             self._cache_file(fileName)
 
     def _cache_file(self, file_name):
-        if file_name in self.image_cache:
+        if file_name in self.image_cache and file_name not in self.full_requested:
             return
         print(f'put {file_name}')
         self.file_queue.put(os.path.join(self.cur_dir, file_name))
@@ -104,41 +231,69 @@ class ImageCache(QObject):
     @pyqtSlot(str)
     def _on_need_cache(self, file_path: str):
         # 主线程判断是否需要加载
-        need_load = file_path in self.cache_set and os.path.basename(file_path) not in self.image_cache
+        file_name = os.path.basename(file_path)
+        need_load = file_path in self.cache_set and (file_name not in self.image_cache or file_name in self.full_requested)
+        if need_load and file_name not in self.image_cache:
+            compressed = self.compressed_cache.get(file_path)
+            if compressed is not None:
+                need_load = compressed
         # 返回结果给子线程
         self.do_cache_queue.put(need_load)
 
-    def _on_cache_done(self, file_path: str, image: QImage, exif_tags: Dict[str, Any]):
+    def _on_cache_done(self, file_path: str, image: QImage, exif_tags: Dict[str, Any], is_preview: bool, stats: Dict[str, Any]):
         if file_path not in self.cache_set:
             return
         file_name = os.path.basename(file_path)
-        if file_name in self.image_cache:
+        if file_name in self.image_cache and (is_preview or file_name not in self.preview_set):
             return
         # print(f'get {file_name}')
         # if file_name.endswith('.CR3'):
         #     print(exif_tags)
-        if 'Image Orientation' in exif_tags:
+        if not is_preview and 'Image Orientation' in exif_tags:
             val = exif_tags['Image Orientation'].values[0]
+            transform = None
             if val == 3:
-                image = image.transformed(QTransform().rotate(180), mode = 1)
+                transform = QTransform().rotate(180)
             elif val == 6:
-                image = image.transformed(QTransform().rotate(90), mode = 1)
+                transform = QTransform().rotate(90)
             elif val == 8:
-                image = image.transformed(QTransform().rotate(-90), mode = 1)
+                transform = QTransform().rotate(-90)
+            if transform is not None:
+                image = image.transformed(transform, mode = 1)
+                stats = transform_stats(stats, transform)
 
         self.image_cache[file_name] = image
         self.exif_cache[file_name] = exif_tags
-        if self.requested_file is not None:
-            file_name = self.requested_file[0]
-            if file_name in self.image_cache:
-                print(f'done return {file_name}')
-                self.requested_file[1](QPixmap.fromImage(self.image_cache[file_name]), self.exif_cache[file_name])
+        self.stats_cache[file_name] = stats
+        if is_preview:
+            self.preview_set.add(file_name)
+        else:
+            self.preview_set.discard(file_name)
+            self.full_requested.discard(file_name)
+        if self.on_cached is not None:
+            self.on_cached(file_name)
+        if self.requested_file is not None and self.requested_file[0] == file_name:
+            print(f'done return {file_name}')
+            self.requested_file[1](QPixmap.fromImage(image), exif_tags, stats)
+            # 预览显示后继续等待需要的原图
+            if not is_preview or file_name not in self.full_requested:
                 self.requested_file = None
 
-    def request_image(self, image_name: str, callback: Callable[[QPixmap, Dict[str, Any]], None]):
+    def request_image(self, image_name: str, callback: Callable[[QPixmap, Dict[str, Any], Dict[str, Any]], None]):
         if image_name in self.image_cache:
             print(f'directly return {image_name}')
-            callback(QPixmap.fromImage(self.image_cache[image_name]), self.exif_cache[image_name])
+            callback(QPixmap.fromImage(self.image_cache[image_name]), self.exif_cache[image_name], self.stats_cache[image_name])
+            # 原图正在解码时，完成后再次回调
+            self.requested_file = (image_name, callback) if image_name in self.full_requested else None
         else:
             print(f'wait {image_name}')
-            self.requested_file = (image_name, callback)
\ No newline at end of file
+            self.requested_file = (image_name, callback)
+
+    def request_full(self, image_name: str, callback: Callable[[QPixmap, Dict[str, Any], Dict[str, Any]], None]):
+        """ 缓存中只有屏幕分辨率的预览时解码原图，完成后回调 """
+        if image_name not in self.preview_set or image_name in self.full_requested:
+            return
+        print(f'request full {image_name}')
+        self.full_requested.add(image_name)
+        self.requested_file = (image_name, callback)
+        self._cache_file(image_name)
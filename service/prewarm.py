@@ -0,0 +1,75 @@
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from service.util import THUMBNAIL_DIR, supported_formats
+from service.thumbnail_loader import get_thumbnail_path, make_thumbnail
+
+REPORT_INTERVAL = 1.0
+
+
+def collect_files(paths: list[str], recursive=True):
+    """ 遍历目录，返回需要生成缩略图的图片 """
+    valid_ext = set(supported_formats())
+    for path in paths:
+        if os.path.isfile(path):
+            yield os.path.abspath(path)
+            continue
+        for dir_path, dir_names, file_names in os.walk(os.path.abspath(path)):
+            # 跳过已删除的图片
+            dir_names[:] = [d for d in dir_names if d != 'trash_pic'] if recursive else []
+            for file_name in sorted(file_names):
+                if os.path.splitext(file_name)[1].lower() in valid_ext:
+                    yield os.path.join(dir_path, file_name)
+
+
+def _prewarm_one(image_path: str, thumbnail_path: str):
+    try:
+        make_thumbnail(image_path, thumbnail_path)
+        return True
+    except Exception as e:
+        print(f'prewarm failed: {image_path}, {e}')
+        return False
+
+
+def prewarm(paths: list[str], thumbnail_dir=THUMBNAIL_DIR, workers=None, recursive=True, force=False):
+    tasks = []
+    skipped = 0
+    for image_path in collect_files(paths, recursive):
+        thumbnail_path = get_thumbnail_path(thumbnail_dir, image_path)
+        # 已生成的缩略图直接跳过，中断后重新运行即可继续
+        if not force and os.path.exists(thumbnail_path):
+            skipped += 1
+            continue
+        tasks.append((image_path, thumbnail_path))
+    print(f'{len(tasks)} to generate, {skipped} already done')
+
+    done = 0
+    failed = 0
+    start = time.monotonic()
+    last_report = start
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [executor.submit(_prewarm_one, *task) for task in tasks]
+        for future in as_completed(futures):
+            done += 1
+            if not future.result():
+                failed += 1
+            now = time.monotonic()
+            if now - last_report >= REPORT_INTERVAL or done == len(tasks):
+                last_report = now
+                print(f'{done}/{len(tasks)} {done / max(now - start, 1e-6):.1f} img/s')
+    print(f'done in {time.monotonic() - start:.1f}s, {failed} failed')
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='main.py prewarm', description='Generate thumbnails without opening the viewer')
+    parser.add_argument("paths", help="image dirs or files", nargs='+')
+    parser.add_argument("-j", "--jobs", help="number of worker processes", type=int, default=None)
+    parser.add_argument("--no-recursive", help="do not walk sub directories", action='store_true')
+    parser.add_argument("--force", help="regenerate existing thumbnails", action='store_true')
+    args = parser.parse_args(argv)
+
+    failed = prewarm(args.paths, workers=args.jobs, recursive=not args.no_recursive, force=args.force)
+    return 1 if failed else 0
@@ -0,0 +1,106 @@
+import os
+import json
+import stat
+import time
+import threading
+
+from PyQt5.QtCore import Qt, QSize, QThread, pyqtSignal
+from PyQt5.QtGui import QImage
+
+SESSION_FILE = 'session.json'
+PREVIEW_QUALITY = 85
+# 生成预览的时间上限，超时后只保存已生成的预览
+SAVE_TIMEOUT = 1.0
+
+
+def _file_mtimes(dir_path: str, file_list: list[str]):
+    mtimes = {}
+    for file_name in file_list:
+        try:
+            st = os.stat(os.path.join(dir_path, file_name))
+        except OSError:
+            continue
+        if stat.S_ISREG(st.st_mode):
+            mtimes[file_name] = st.st_mtime
+    return mtimes
+
+
+def save_session(session_dir: str, cur_dir: str, file_list: list[str], selected: str,
+                 images: dict[str, QImage], preview_size: QSize, timeout=SAVE_TIMEOUT):
+    """ 保存文件列表、当前图片以及当前和相邻图片的屏幕尺寸预览，images 按优先级排列 """
+    os.makedirs(session_dir, exist_ok=True)
+    deadline = time.monotonic() + timeout
+
+    # 预览使用新文件名，session.json 替换成功后再删除旧预览，保存中途失败时旧会话仍然可用
+    prefix = f'{time.time_ns()}-'
+    previews = {}
+    for i, (file_name, image) in enumerate(images.items()):
+        if time.monotonic() > deadline:
+            print(f'save session: timeout, {len(images) - i} previews skipped')
+            break
+        if image.width() > preview_size.width() or image.height() > preview_size.height():
+            image = image.scaled(preview_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        preview_name = f'{prefix}{i}.jpg'
+        if image.save(os.path.join(session_dir, preview_name), 'JPG', PREVIEW_QUALITY):
+            previews[file_name] = preview_name
+
+    session = {
+        'dir': cur_dir,
+        'selected': selected,
+        'files': _file_mtimes(cur_dir, file_list),
+        'previews': previews,
+    }
+    session_path = os.path.join(session_dir, SESSION_FILE)
+    with open(session_path + '.part', 'w', encoding='utf-8') as f:
+        json.dump(session, f, ensure_ascii=False)
+    os.replace(session_path + '.part', session_path)
+
+    current = set(previews.values())
+    for name in os.listdir(session_dir):
+        if name.endswith('.jpg') and name not in current:
+            os.remove(os.path.join(session_dir, name))
+
+
+def load_session(session_dir: str):
+    try:
+        with open(os.path.join(session_dir, SESSION_FILE), 'r', encoding='utf-8') as f:
+            session = json.load(f)
+    except (OSError, ValueError):
+        return None
+    session['previews'] = {file_name: os.path.join(session_dir, preview_name)
+                           for file_name, preview_name in session['previews'].items()}
+    return session
+
+
+def save_session_async(*args, **kwargs):
+    """ 在后台线程中保存，返回线程以便退出前等待 """
+    def run():
+        try:
+            save_session(*args, **kwargs)
+        except Exception as e:
+            print('save session failed:', e)
+    # daemon 线程不阻止程序退出，session.json 原子替换，中途退出不会损坏旧会话
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+class SessionValidator(QThread):
+    validated = pyqtSignal(bool, list)  # 目录是否有变化，内容变化的图片
+
+    def __init__(self, session: dict, valid_ext: set):
+        super().__init__()
+        self.session = session
+        self.valid_ext = valid_ext
+
+    def run(self):
+        cur_dir = self.session['dir']
+        old_mtimes: dict = self.session['files']
+        try:
+            file_list = [f for f in os.listdir(cur_dir) if os.path.splitext(f)[1].lower() in self.valid_ext]
+        except OSError:
+            self.validated.emit(True, [])
+            return
+        mtimes = _file_mtimes(cur_dir, file_list)
+        changed = [file_name for file_name, mtime in mtimes.items() if old_mtimes.get(file_name) != mtime]
+        self.validated.emit(set(mtimes) != set(old_mtimes), changed)
@@ -1,41 +1,122 @@
 import os
+import time
 import queue
 from pathlib import Path
 from typing import Callable
 
-from PyQt5.QtCore import Qt, QObject, QThread, pyqtSignal
+from PyQt5.QtCore import Qt, QObject, QThread, QSize, pyqtSignal
 from PyQt5.QtGui import QIcon, QImage, QPixmap
 
 from service.util import read_image
+from service.decode_pipeline import pipeline
+
+THUMBNAIL_HEIGHT = 80
+# 解码时先缩小到缩略图的两倍高度，再平滑缩放
+THUMBNAIL_DECODE_SIZE = QSize(THUMBNAIL_HEIGHT * 16, THUMBNAIL_HEIGHT * 2)
+# 等待大图缓存解码的最长时间，超时后自行缩小解码
+DEFER_TIMEOUT = 10.0
+
+def get_thumbnail_path(thumbnail_dir: str, image_path: str):
+    _image_path = os.path.abspath(image_path).replace('_','-').replace(os.sep,'_')
+    if not _image_path.endswith(".JPG"):
+        _image_path += ".JPG"
+    return os.path.join(thumbnail_dir, _image_path)
+
+def make_thumbnail(image_path: str, thumbnail_path: str):
+    return save_thumbnail(read_image(image_path, THUMBNAIL_DECODE_SIZE), thumbnail_path)
+
+def save_thumbnail(image: QImage, thumbnail_path: str):
+    thumbnail = image.scaledToHeight(THUMBNAIL_HEIGHT, Qt.SmoothTransformation)
+    # 先写临时文件再改名，中断时不会留下不完整的缩略图
+    tmp_path = thumbnail_path + '.part'
+    if not thumbnail.save(tmp_path, 'JPG'):
+        raise IOError(f'save thumbnail failed: {thumbnail_path}')
+    os.replace(tmp_path, thumbnail_path)
+    return thumbnail
 
 class ThumbnailWorker(QThread):
     loaded = pyqtSignal(str, QImage)
 
-    def __init__(self, queue: queue.Queue):
+    def __init__(self, task_queue: queue.Queue, thumbnail_dir: str):
         super().__init__()
-        self.queue = queue
+        self.queue = task_queue
+        self.thumbnail_dir = thumbnail_dir
         self.running = True
+        # 大图解码完成后交给本线程生成缩略图，不占用解码线程
+        self.decoded_queue = queue.Queue()
+        # 等待大图缓存解码的图片，image_path -> (thumbnail_path, deadline)
+        self.deferred: dict[str, tuple[str, float]] = {}
+        pipeline.add_consumer(self.on_decoded)
 
     def run(self):
         while self.running:
+            # 优先处理已解码的图片，免得再解码一次
+            try:
+                image_path, image = self.decoded_queue.get_nowait()
+                self.save_decoded(image_path, image)
+                continue
+            except queue.Empty:
+                pass
+
+            # 已离开缓存范围或等待超时的图片自行解码
+            if self.undefer():
+                continue
+
             try:
-                image_path, thumbnail_path = self.queue.get(timeout=1)  # 等待新任务
+                image_path, thumbnail_path = self.queue.get(timeout=0.2)  # 等待新任务
             except queue.Empty:
                 continue
-            
-            self.thumbnail(image_path, thumbnail_path)
+
+            if pipeline.will_decode(image_path) and not os.path.exists(thumbnail_path):
+                # 大图缓存会完整解码，由 on_decoded 生成缩略图
+                self.deferred[os.path.abspath(image_path)] = (thumbnail_path, time.monotonic() + DEFER_TIMEOUT)
+            else:
+                self.thumbnail(image_path, thumbnail_path)
             self.queue.task_done()
 
+    def undefer(self):
+        now = time.monotonic()
+        for image_path, (thumbnail_path, deadline) in self.deferred.items():
+            if now > deadline or not pipeline.will_decode(image_path):
+                del self.deferred[image_path]
+                self.thumbnail(image_path, thumbnail_path)
+                return True
+        return False
+
     def thumbnail(self, image_path: str, thumbnail_path: str):
         # print(f'____tstart {image_path}')
         
         try: # 防止加载时被删除导致崩溃
-            thumbnail = read_image(image_path).scaledToHeight(80, Qt.SmoothTransformation)
-            thumbnail.save(thumbnail_path)
+            if os.path.exists(thumbnail_path):
+                # 已由其他解码顺带生成
+                self.loaded.emit(thumbnail_path, QImage(thumbnail_path))
+                return
+            image, _ = pipeline.decode(image_path, THUMBNAIL_DECODE_SIZE)
+            thumbnail = save_thumbnail(image, thumbnail_path)
             self.loaded.emit(thumbnail_path, thumbnail)
         except:
             pass
 
+    def on_decoded(self, image_path: str, image: QImage, exif_tags):
+        # 在解码线程中调用，只入队
+        if not os.path.exists(get_thumbnail_path(self.thumbnail_dir, image_path)):
+            self.decoded_queue.put((image_path, image))
+
+    def save_decoded(self, image_path: str, image: QImage):
+        thumbnail_path = get_thumbnail_path(self.thumbnail_dir, image_path)
+        deferred = self.deferred.pop(image_path, None) is not None
+        if os.path.exists(thumbnail_path):
+            if deferred:
+                self.loaded.emit(thumbnail_path, QImage(thumbnail_path))
+            return
+        try:
+            thumbnail = save_thumbnail(image, thumbnail_path)
+            self.loaded.emit(thumbnail_path, thumbnail)
+        except:
+            return
+        if deferred:
+            pipeline.record_shared(image_path)
+
 
 class ThumbnailLoader(QObject):
     def __init__(self, thumbnail_dir: str):
@@ -44,15 +125,12 @@ class ThumbnailLoader(QObject):
         self.pending_dict: dict[str, Callable[[QIcon], None]] = {}
 
         self.worker_queue = queue.Queue()
-        self.worker = ThumbnailWorker(self.worker_queue)
+        self.worker = ThumbnailWorker(self.worker_queue, self.thumbnail_dir)
         self.worker.loaded.connect(self.on_thumbnailed)
         self.worker.start()
     
     def request_thumbnail(self, image_path: str, callback: Callable[[QIcon], None]):
-        _image_path = image_path.replace('_','-').replace(os.sep,'_')
-        if not image_path.endswith(".JPG"):
-            _image_path += ".JPG"
-        thumbnail_path = os.path.join(self.thumbnail_dir,  _image_path)
+        thumbnail_path = get_thumbnail_path(self.thumbnail_dir, image_path)
         if os.path.exists(thumbnail_path):
             callback(QIcon(thumbnail_path))
         else:
@@ -1,10 +1,10 @@
 import os
-import rawpy
-import imageio
+import threading
 import subprocess
 
 from pathlib import Path
-from PyQt5.QtGui import QImage
+from PyQt5.QtCore import Qt, QSize, QRect, QBuffer, QIODevice
+from PyQt5.QtGui import QImage, QImageReader
 
 def calc_exif_number(fstr, number=1):
     fstr = str(fstr)
@@ -17,54 +17,250 @@ def calc_exif_number(fstr, number=1):
 
 DNG_CONVERTER_PATH = "/Applications/Adobe DNG Converter.app/Contents/MacOS/Adobe DNG Converter"
 
-NORMAL_FORMAT = ['.png', '.jpg', '.jpeg', '.tif', '.bmp']
+NORMAL_FORMAT = ['.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp']
+# 需要 Qt 图片插件或 Pillow 插件支持，见 supported_formats
+OPTIONAL_FORMAT = ['.webp', '.heic', '.heif', '.avif', '.jxl']
 RAW_FORMAT = ['.cr2', '.cr3', '.nef', '.arw', '.orf', '.dng']
 
 NORMAL_FORMAT_SET = set(NORMAL_FORMAT)
 THUMBNAIL_DIR = os.path.join(Path.home(),'.jthumb')
 os.makedirs(THUMBNAIL_DIR, exist_ok=True)
 
-def read_image(file_path):
-    if Path(file_path).suffix.lower() in NORMAL_FORMAT_SET:
-        return QImage(file_path)
-    # read raw
-    print(f'read as raw of {os.path.basename(file_path)}')
-    try:
+def _fit_size(orig: QSize, size: QSize):
+    """ 按比例缩小到 size 以内，不放大 """
+    if not orig.isValid() or (orig.width() <= size.width() and orig.height() <= size.height()):
+        return None
+    return orig.scaled(size, Qt.KeepAspectRatio)
+
+def _read_with_qt(reader: QImageReader, size: QSize = None, rect: QRect = None):
+    if rect is not None:
+        reader.setClipRect(rect)
+    if size is not None:
+        orig = rect.size() if rect is not None else reader.size()
+        scaled_size = _fit_size(orig, size)
+        if scaled_size is not None:
+            # jpeg 等格式解码时直接缩小，比解码后再缩放快得多
+            reader.setScaledSize(scaled_size)
+    image = reader.read()
+    if image.isNull():
+        raise IOError(reader.errorString())
+    return image
+
+def _numpy_to_qimage(img):
+    # numpy 数组转 QImage
+    height, width, channel = img.shape
+    bytes_per_line = channel * width
+    return QImage(img.data, width, height, bytes_per_line, QImage.Format_RGB888).copy()
+
+class Decoder:
+    """ 解码器基类，声明支持的后缀和能力 """
+    name = ''
+    extensions: tuple[str] = ()
+    cost = 0  # 越小越优先
+    scaled = False  # 支持解码时缩小
+    roi = False  # 支持只解码部分区域
+    preview = False  # 使用内嵌预览图
+    thread_safe = True
+
+    def __init__(self):
+        # 可重入，decode 内部可能再次加锁
+        self.lock = threading.RLock()
+
+    def supports(self, ext: str):
+        return ext in self.extensions
+
+    def candidate_extensions(self):
+        """ 可能支持的后缀，实际是否支持由 supports 判断 """
+        return self.extensions
+
+    def decode(self, file_path: str, size: QSize = None, rect: QRect = None) -> QImage:
+        raise NotImplementedError
+
+class QtDecoder(Decoder):
+    name = 'qt'
+    extensions = tuple(NORMAL_FORMAT)
+    # 是否支持取决于安装的 Qt 图片插件
+    plugin_extensions = tuple(OPTIONAL_FORMAT)
+    cost = 0
+    scaled = True
+    roi = True
+
+    def __init__(self):
+        super().__init__()
+        self.plugin_formats = None
+
+    def supports(self, ext: str):
+        if ext in self.extensions:
+            return True
+        if ext not in self.plugin_extensions:
+            return False
+        if self.plugin_formats is None:
+            self.plugin_formats = set(['.' + bytes(f).decode().lower() for f in QImageReader.supportedImageFormats()])
+        return ext in self.plugin_formats
+
+    def candidate_extensions(self):
+        return self.extensions + self.plugin_extensions
+
+    def decode(self, file_path, size=None, rect=None):
+        return _read_with_qt(QImageReader(file_path), size, rect)
+
+class PillowDecoder(Decoder):
+    name = 'pillow'
+    extensions = tuple(OPTIONAL_FORMAT)
+    cost = 1
+    scaled = True
+
+    def __init__(self):
+        super().__init__()
+        # 插件注册后 Pillow 实际能打开的后缀，None 表示尚未检查
+        self.available_extensions: set = None
+
+    def _register_plugins(self):
+        with self.lock:
+            if self.available_extensions is not None:
+                return self.available_extensions
+            self.available_extensions = set()
+            try:
+                from PIL import Image, features
+            except ImportError:
+                return self.available_extensions
+            # 可选插件，没有安装时对应格式无法打开
+            try:
+                from pillow_heif import register_heif_opener
+                register_heif_opener()
+            except ImportError:
+                pass
+            for module in ('pillow_avif', 'pillow_jxl'):
+                try:
+                    __import__(module)
+                except ImportError:
+                    pass
+            registered = set(Image.registered_extensions())
+            if not features.check('webp'):
+                registered.discard('.webp')
+            self.available_extensions = registered & set(self.extensions)
+            return self.available_extensions
+
+    def supports(self, ext: str):
+        return ext in self.extensions and ext in self._register_plugins()
+
+    def decode(self, file_path, size=None, rect=None):
+        import numpy as np
+        from PIL import Image
+        self._register_plugins()
+        with Image.open(file_path) as img:
+            if size is not None:
+                img.draft('RGB', (size.width(), size.height()))
+                img.thumbnail((size.width(), size.height()))
+            img = img.convert('RGB')
+            return _numpy_to_qimage(np.asarray(img))
+
+class RawDecoder(Decoder):
+    name = 'raw'
+    extensions = tuple(RAW_FORMAT)
+    cost = 2
+    scaled = True
+    preview = True
+
+    def decode(self, file_path, size=None, rect=None):
+        # rawpy 导入较慢，用到时再导入以加快启动
+        import rawpy
+        print(f'read as raw of {os.path.basename(file_path)}')
+        try:
+            return self._decode_raw(rawpy, file_path, size)
+        except Exception:
+            print('not support, using dng converter')
+        # dng 转换输出到同一目录，同时只转换一个
+        with self.lock:
+            dng_file = convert2dng(file_path, THUMBNAIL_DIR)
+            if dng_file is None:
+                raise IOError('DNG Converter not install!')
+            try:
+                return self._decode_raw(rawpy, dng_file, size)
+            finally:
+                os.remove(dng_file)
+
+    def _decode_raw(self, rawpy, file_path, size):
         with rawpy.imread(file_path) as raw:
-            thumb = raw.extract_thumb()
-            if thumb.format == rawpy.ThumbFormat.JPEG:
+            try:
+                thumb = raw.extract_thumb()
+            except rawpy.LibRawError:
+                thumb = None
+            if thumb is not None and thumb.format == rawpy.ThumbFormat.JPEG:
                 # JPEG 预览
-                img = imageio.imread(thumb.data)
-            elif thumb.format == rawpy.ThumbFormat.BITMAP:
+                buffer = QBuffer()
+                buffer.setData(thumb.data)
+                buffer.open(QIODevice.ReadOnly)
+                return _read_with_qt(QImageReader(buffer, b'jpg'), size)
+            if thumb is not None and thumb.format == rawpy.ThumbFormat.BITMAP:
                 # BITMAP 预览，直接用 numpy 数组
-                img = thumb.data
+                image = _numpy_to_qimage(thumb.data)
             else:
                 # 没有预览图，用解码后的图片
-                img = raw.postprocess()
-    except:
-        print('not support, using dng converter')
-        dng_file = convert2dng(file_path, THUMBNAIL_DIR)
-        if dng_file is None:
-            print('DNG Converter not install!')
-        else:
-            with rawpy.imread(dng_file) as raw:
-                thumb = raw.extract_thumb()
-                if thumb.format == rawpy.ThumbFormat.JPEG:
-                    # JPEG 预览
-                    img = imageio.imread(thumb.data)
-                elif thumb.format == rawpy.ThumbFormat.BITMAP:
-                    # BITMAP 预览，直接用 numpy 数组
-                    img = thumb.data
-                else:
-                    # 没有预览图，用解码后的图片
-                    img = raw.postprocess()
-            os.remove(dng_file)
-        
+                image = _numpy_to_qimage(raw.postprocess(half_size=size is not None))
+        if size is not None and _fit_size(image.size(), size) is not None:
+            image = image.scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        return image
 
-    # numpy 数组转 QImage
-    height, width, channel = img.shape
-    bytes_per_line = channel * width
-    return QImage(img.data, width, height, bytes_per_line, QImage.Format_RGB888).copy()
+DECODERS: list[Decoder] = []
+
+_supported_formats: list[str] = None
+
+def register_decoder(decoder: Decoder):
+    global _supported_formats
+    DECODERS.append(decoder)
+    DECODERS.sort(key=lambda d: d.cost)
+    _supported_formats = None
+
+register_decoder(QtDecoder())
+register_decoder(PillowDecoder())
+register_decoder(RawDecoder())
+
+def supported_formats():
+    """ 已注册的解码器实际能打开的后缀，第一次调用时检查插件 """
+    global _supported_formats
+    if _supported_formats is None:
+        formats = []
+        for decoder in DECODERS:
+            for ext in decoder.candidate_extensions():
+                if ext not in formats and decoder.supports(ext):
+                    formats.append(ext)
+        _supported_formats = formats
+    return _supported_formats
+
+def get_decoder(file_path, scaled=False, roi=False, preview=False):
+    """ 返回满足要求且代价最小的解码器 """
+    ext = Path(file_path).suffix.lower()
+    for decoder in DECODERS:
+        if not decoder.supports(ext):
+            continue
+        if (scaled and not decoder.scaled) or (roi and not decoder.roi) or (preview and not decoder.preview):
+            continue
+        return decoder
+    return None
+
+def read_image(file_path, size: QSize = None, rect: QRect = None, decoder: Decoder = None):
+    """ 读取图片，size 不为空时缩小到 size 以内，rect 不为空时只读取该区域 """
+    if decoder is None:
+        decoder = get_decoder(file_path, scaled=size is not None, roi=rect is not None) or get_decoder(file_path)
+    if decoder is None:
+        raise ValueError(f'unsupported format: {file_path}')
+
+    _rect = rect if decoder.roi else None
+    # 需要解码后再裁剪时不能先缩小
+    _size = size if decoder.scaled and (rect is None or _rect is not None) else None
+    if decoder.thread_safe:
+        image = decoder.decode(file_path, _size, _rect)
+    else:
+        with decoder.lock:
+            image = decoder.decode(file_path, _size, _rect)
+
+    # 解码器不支持的部分在解码后处理
+    if rect is not None and _rect is None:
+        image = image.copy(rect)
+    if size is not None and _size is None and _fit_size(image.size(), size) is not None:
+        image = image.scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return image
 
 def convert2dng(file_path, target_dir):
     if not os.path.isfile(DNG_CONVERTER_PATH):
@@ -76,6 +272,7 @@ def convert2dng(file_path, target_dir):
         "-d", target_dir,
         file_path
     ]
-    os.remove(dng_path)
+    if os.path.exists(dng_path):
+        os.remove(dng_path)
     subprocess.run(cmd, check=True)
     return dng_path
\ No newline at end of file